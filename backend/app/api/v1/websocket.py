@@ -208,17 +208,18 @@ async def websocket_endpoint(
                 })
 
     except WebSocketDisconnect:
-        manager.disconnect(device_id)
-        await manager.broadcast_system_message(
-            "device_offline",
-            {"device_id": device_id, "online_count": manager.get_connection_count(user_id=user.id)},
-            user_id=user.id
-        )
+        # 同一设备已重新连接时，旧连接断开不影响在线状态
+        if manager.disconnect(device_id, websocket):
+            await manager.broadcast_system_message(
+                "device_offline",
+                {"device_id": device_id, "online_count": manager.get_connection_count(user_id=user.id)},
+                user_id=user.id
+            )
         logger.info(f"[WS] 断开: {device_id}")
 
     except Exception as e:
         logger.error(f"[WS] 错误: {device_id}, {e}")
-        manager.disconnect(device_id)
+        manager.disconnect(device_id, websocket)
 
 
 # ===== 处理函数 =====
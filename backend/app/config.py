@@ -12,12 +12,14 @@ class Settings(BaseSettings):
     HOST: str = "0.0.0.0"
     PORT: int = 8000
     DEBUG: bool = True
+    WORKERS: int = 1  # worker 进程数，大于 1 时需要使用 redis 广播总线
     
     # SQLAlchemy 配置
     SQLALCHEMY_ECHO: bool = False  # 设置为 False 隐藏 SQL 日志
     
     # 数据库配置
     DATABASE_PATH: str = "./data/clipboard.db"
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000  # 多 worker 并发写入时等待锁的时间（毫秒）
     
     # 日志配置
     LOG_LEVEL: str = "INFO"
@@ -26,6 +28,13 @@ class Settings(BaseSettings):
     # 文件上传配置
     UPLOAD_DIR: str = "./uploads"
 
+    # 广播总线配置（memory: 进程内, redis: 多 worker 共享）
+    BROADCAST_BACKEND: str = "memory"
+    BROADCAST_REDIS_URL: str = "redis://localhost:6379/0"
+    BROADCAST_CHANNEL: str = "ecopaste:broadcast"
+    PRESENCE_HEARTBEAT_INTERVAL: int = 10  # worker 存活心跳间隔（秒）
+    PRESENCE_TTL: int = 35  # 超过该时间未收到心跳的 worker，其设备视为离线（秒）
+
     # API 配置
     API_PREFIX: str = "/api/v1"
     PROJECT_NAME: str = "EcoPaste History API"
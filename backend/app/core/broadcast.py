@@ -0,0 +1,183 @@
+"""
+跨进程广播总线
+多个 uvicorn worker 通过总线共享 WebSocket 广播和设备在线状态
+"""
+import asyncio
+import json
+import uuid
+from typing import Awaitable, Callable, Optional
+from loguru import logger
+
+from app.config import settings
+
+# 总线消息处理函数: (envelope, remote) -> None
+# remote 为 True 表示消息来自其他 worker
+EnvelopeHandler = Callable[[dict, bool], Awaitable[None]]
+# 总线重新连接后的回调，用于补发连接中断期间丢失的状态
+ReconnectHandler = Callable[[], Awaitable[None]]
+
+
+class BroadcastBus:
+    """
+    广播总线基类
+    envelope 为可 JSON 序列化的字典，kind 字段区分消息类型:
+    - message: 需要投递给设备的广播消息
+    - presence: 设备上线/下线等在线状态同步
+    """
+
+    # 是否跨进程（单进程总线不需要同步在线状态）
+    distributed = False
+
+    def __init__(self):
+        self.worker_id = uuid.uuid4().hex
+        self._handler: Optional[EnvelopeHandler] = None
+        self._reconnect_handler: Optional[ReconnectHandler] = None
+
+    def set_handler(self, handler: EnvelopeHandler):
+        """设置总线消息处理函数"""
+        self._handler = handler
+
+    def set_reconnect_handler(self, handler: ReconnectHandler):
+        """设置总线重新连接后的回调"""
+        self._reconnect_handler = handler
+
+    async def start(self):
+        """启动总线"""
+
+    async def stop(self):
+        """停止总线"""
+
+    async def publish(self, envelope: dict):
+        """
+        发布消息到总线
+
+        Args:
+            envelope: 总线消息
+        """
+        raise NotImplementedError
+
+    async def _dispatch(self, envelope: dict, remote: bool):
+        """调用处理函数，异常不影响总线运行"""
+        if not self._handler:
+            return
+        try:
+            await self._handler(envelope, remote)
+        except Exception as e:
+            logger.error(f"广播总线消息处理失败: {e}")
+
+
+class MemoryBroadcastBus(BroadcastBus):
+    """进程内广播总线（默认，单 worker 部署）"""
+
+    async def publish(self, envelope: dict):
+        await self._dispatch(envelope, remote=False)
+
+
+class RedisBroadcastBus(BroadcastBus):
+    """
+    基于 Redis Pub/Sub 的广播总线（兼容 Valkey/KeyDB 等 Redis 协议实现）
+    本 worker 发布的消息直接在本地投递，订阅到的自身消息会被忽略
+    """
+
+    distributed = True
+
+    def __init__(self, url: str, channel: str):
+        super().__init__()
+        self.url = url
+        self.channel = channel
+        self._redis = None
+        self._pubsub = None
+        self._listener_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._listener_task and not self._listener_task.done():
+            return
+
+        try:
+            import redis.asyncio as aioredis
+        except ImportError:
+            raise RuntimeError("BROADCAST_BACKEND=redis 需要安装 redis 包: pip install redis")
+
+        self._redis = aioredis.from_url(self.url)
+        self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.subscribe(self.channel)
+        self._listener_task = asyncio.create_task(self._listen())
+        logger.info(f"Redis 广播总线已启动: channel={self.channel}, worker={self.worker_id[:8]}")
+
+    async def stop(self):
+        if self._listener_task and not self._listener_task.done():
+            self._listener_task.cancel()
+            try:
+                await self._listener_task
+            except asyncio.CancelledError:
+                pass
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+        if self._redis is not None:
+            await self._redis.aclose()
+        self._listener_task = None
+        self._pubsub = None
+        self._redis = None
+        logger.info("Redis 广播总线已停止")
+
+    async def publish(self, envelope: dict):
+        await self._dispatch(envelope, remote=False)
+
+        if self._redis is None:
+            return
+        try:
+            await self._redis.publish(
+                self.channel,
+                json.dumps({"origin": self.worker_id, "envelope": envelope})
+            )
+        except Exception as e:
+            logger.error(f"发布广播消息到 Redis 失败: {e}")
+
+    async def _listen(self):
+        """订阅循环，将其他 worker 的消息投递到本地"""
+        while True:
+            try:
+                async for raw in self._pubsub.listen():
+                    if raw.get("type") != "message":
+                        continue
+                    packet = json.loads(raw["data"])
+                    if packet.get("origin") == self.worker_id:
+                        continue
+                    await self._dispatch(packet["envelope"], remote=True)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Redis 广播订阅异常，1 秒后重试: {e}")
+                await asyncio.sleep(1)
+                await self._resubscribe()
+
+    async def _resubscribe(self):
+        """重新订阅频道，成功后通知上层补发中断期间丢失的状态"""
+        while True:
+            try:
+                await self._pubsub.aclose()
+                self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                await self._pubsub.subscribe(self.channel)
+                break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Redis 重新订阅失败，1 秒后重试: {e}")
+                await asyncio.sleep(1)
+
+        logger.info(f"Redis 广播总线已重新订阅: channel={self.channel}")
+        if self._reconnect_handler:
+            try:
+                await self._reconnect_handler()
+            except Exception as e:
+                logger.error(f"广播总线重连回调失败: {e}")
+
+
+def create_broadcast_bus() -> BroadcastBus:
+    """根据配置创建广播总线"""
+    backend = settings.BROADCAST_BACKEND.lower()
+    if backend == "redis":
+        return RedisBroadcastBus(settings.BROADCAST_REDIS_URL, settings.BROADCAST_CHANNEL)
+    if backend != "memory":
+        logger.warning(f"未知的广播总线类型: {settings.BROADCAST_BACKEND}，使用进程内总线")
+    return MemoryBroadcastBus()
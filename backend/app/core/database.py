@@ -8,6 +8,8 @@ from sqlalchemy.ext.asyncio import (
     AsyncSession,
     AsyncEngine
 )
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
 from loguru import logger
 from app.config import settings
 from app.models.db_models import Base
@@ -31,6 +33,14 @@ class Database:
                 future=True,
                 pool_pre_ping=True,  # 连接池预检查
             )
+
+            # SQLite 并发设置：WAL 允许读写并发，busy_timeout 让多 worker 并发写入时等待锁而不是直接报错
+            @event.listens_for(self.engine.sync_engine, "connect")
+            def _set_sqlite_pragma(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                cursor.execute("PRAGMA journal_mode=WAL")
+                cursor.execute(f"PRAGMA busy_timeout={settings.SQLITE_BUSY_TIMEOUT_MS}")
+                cursor.close()
             
             self.async_session_maker = async_sessionmaker(
                 self.engine,
@@ -48,8 +58,15 @@ class Database:
             if not self.engine:
                 self.init_engine()
             
-            async with self.engine.begin() as conn:
-                await conn.run_sync(Base.metadata.create_all)
+            try:
+                async with self.engine.begin() as conn:
+                    await conn.run_sync(Base.metadata.create_all)
+            except OperationalError as e:
+                # 多 worker 同时启动时可能并发建表，重试一次即可跳过已存在的表
+                if "already exists" not in str(e):
+                    raise
+                async with self.engine.begin() as conn:
+                    await conn.run_sync(Base.metadata.create_all)
             
             logger.info("数据库表创建成功")
         except Exception as e:
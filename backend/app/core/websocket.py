@@ -6,6 +6,10 @@ from fastapi import WebSocket
 from loguru import logger
 from datetime import datetime
 import asyncio
+import time
+
+from app.config import settings
+from app.core.broadcast import create_broadcast_bus
 
 
 class ConnectionManager:
@@ -13,6 +17,7 @@ class ConnectionManager:
     WebSocket 连接管理器
     管理多个设备的 WebSocket 连接，支持消息广播和设备间同步
     支持用户隔离：每个用户只能看到和同步自己的设备
+    支持多 worker：广播和设备在线状态通过广播总线在进程间共享
     """
     
     def __init__(self):
@@ -24,6 +29,18 @@ class ConnectionManager:
         self.clipboard_queue: asyncio.Queue = asyncio.Queue()
         # 队列消费者任务
         self._queue_consumer_task = None
+        # 其他 worker 上的在线设备: {device_id: {"device_name", "user_id", "username", "connected_at", "worker_id"}}
+        self.remote_devices: Dict[str, dict] = {}
+        # 广播总线（进程内或跨进程）
+        self.bus = create_broadcast_bus()
+        self.bus.set_handler(self._handle_bus_envelope)
+        self.bus.set_reconnect_handler(self._on_bus_reconnect)
+        # 其他 worker 最近一次心跳时间: {worker_id: monotonic 时间}
+        self._worker_last_seen: Dict[str, float] = {}
+        # worker 存活心跳任务
+        self._presence_task = None
+        # 后台任务引用，防止被垃圾回收
+        self._background_tasks: set = set()
     
     async def connect(self, websocket: WebSocket, device_id: str, device_name: str = None, user_id: int = None, username: str = None):
         """
@@ -55,6 +72,10 @@ class ConnectionManager:
         }
         
         logger.info(f"设备已连接: {device_id} ({device_name}), 用户: {username} (ID={user_id}), 当前在线: {len(self.active_connections)}")
+
+        # 同步在线状态到其他 worker
+        if self.bus.distributed:
+            await self._publish_presence("join", device_id)
         
         # 通知同一用户的其他设备有新设备上线
         if user_id is not None:
@@ -70,13 +91,22 @@ class ConnectionManager:
                 user_id=user_id
             )
     
-    def disconnect(self, device_id: str):
+    def disconnect(self, device_id: str, websocket: WebSocket = None) -> bool:
         """
         断开设备连接
         
         Args:
             device_id: 设备唯一标识
+            websocket: 要断开的连接对象，指定时只有它仍是该设备的当前连接才会移除
+                       （防止同一设备重连后，旧连接的断开处理误删新连接）
+
+        Returns:
+            是否移除了设备的当前连接
         """
+        if websocket is not None and self.active_connections.get(device_id) is not websocket:
+            logger.debug(f"忽略过期连接的断开: {device_id}")
+            return False
+
         if device_id in self.active_connections:
             del self.active_connections[device_id]
         
@@ -84,8 +114,12 @@ class ConnectionManager:
         if device_id in self.device_info:
             device_name = self.device_info[device_id].get("device_name")
             del self.device_info[device_id]
+
+            if self.bus.distributed:
+                self._spawn(self._publish_presence("leave", device_id))
         
         logger.info(f"设备已断开: {device_id} ({device_name}), 当前在线: {len(self.active_connections)}")
+        return True
     
     async def send_personal_message(self, message: dict, device_id: str):
         """
@@ -101,7 +135,7 @@ class ConnectionManager:
                 await websocket.send_json(message)
             except Exception as e:
                 logger.error(f"发送消息失败 ({device_id}): {e}")
-                self.disconnect(device_id)
+                self.disconnect(device_id, websocket)
     
     async def broadcast(self, message: dict, exclude_device: str = None, user_id: int = None):
         """
@@ -112,6 +146,23 @@ class ConnectionManager:
             exclude_device: 要排除的设备ID（通常是发送者）
             user_id: 用户ID，如果指定则只广播给该用户的设备
         """
+        # 通过广播总线发布，由各 worker 投递给本地连接的设备
+        await self.bus.publish({
+            "kind": "message",
+            "message": message,
+            "exclude_device": exclude_device,
+            "user_id": user_id
+        })
+
+    async def _deliver_local(self, message: dict, exclude_device: str = None, user_id: int = None):
+        """
+        将广播消息投递给本 worker 上连接的设备
+
+        Args:
+            message: 消息内容
+            exclude_device: 要排除的设备ID
+            user_id: 用户ID，如果指定则只发送给该用户的设备
+        """
         disconnected = []
         
         logger.info(f"开始广播: 总设备数={len(self.active_connections)}, 排除设备={exclude_device}, 目标用户ID={user_id}")
@@ -136,11 +187,160 @@ class ConnectionManager:
                 logger.info(f"✓ 消息已发送到: {device_id}")
             except Exception as e:
                 logger.error(f"广播消息失败 ({device_id}): {e}")
-                disconnected.append(device_id)
+                disconnected.append((device_id, websocket))
         
         # 清理断开的连接
-        for device_id in disconnected:
-            self.disconnect(device_id)
+        for device_id, websocket in disconnected:
+            self.disconnect(device_id, websocket)
+
+    async def _handle_bus_envelope(self, envelope: dict, remote: bool):
+        """
+        处理广播总线消息
+
+        Args:
+            envelope: 总线消息
+            remote: 是否来自其他 worker
+        """
+        kind = envelope.get("kind")
+
+        if kind == "message":
+            await self._deliver_local(
+                envelope["message"],
+                exclude_device=envelope.get("exclude_device"),
+                user_id=envelope.get("user_id")
+            )
+        elif kind == "presence" and remote:
+            await self._apply_remote_presence(envelope)
+
+    async def _on_bus_reconnect(self):
+        """
+        广播总线重新连接后，重新登记本地设备并请求其他 worker 的在线设备快照，
+        补齐连接中断期间丢失的 join/leave
+        """
+        await self._publish_presence("sync")
+        for device_id in list(self.device_info.keys()):
+            await self._publish_presence("join", device_id)
+
+    async def _apply_remote_presence(self, envelope: dict):
+        """
+        更新其他 worker 的设备在线状态
+
+        Args:
+            envelope: presence 总线消息，op 为 join/leave/sync/alive/stop
+        """
+        op = envelope.get("op")
+        device_id = envelope.get("device_id")
+        worker_id = envelope.get("worker_id")
+
+        # 任何 presence 消息都视为该 worker 的存活心跳
+        is_new_worker = worker_id not in self._worker_last_seen
+        self._worker_last_seen[worker_id] = time.monotonic()
+
+        if op == "alive":
+            # 之前未知（或已因超时被清理）的 worker，请求全量快照以恢复其设备
+            if is_new_worker:
+                await self._publish_presence("sync")
+        elif op == "join":
+            self.remote_devices[device_id] = {**envelope["info"], "worker_id": worker_id}
+            # 同一设备在其他 worker 重新连接，关闭本地的旧连接
+            if device_id in self.active_connections:
+                old_ws = self.active_connections[device_id]
+                self.disconnect(device_id, old_ws)
+                try:
+                    await old_ws.close(code=1000, reason="New connection from same device")
+                except:
+                    pass
+        elif op == "leave":
+            # 只移除由该 worker 登记的设备，避免误删设备在其他 worker 的新连接
+            remote_info = self.remote_devices.get(device_id)
+            if remote_info and remote_info.get("worker_id") == worker_id:
+                del self.remote_devices[device_id]
+        elif op == "sync":
+            # 新启动的 worker 请求在线设备快照
+            for local_device_id in list(self.device_info.keys()):
+                await self._publish_presence("join", local_device_id)
+        elif op == "stop":
+            # worker 正常退出，移除其全部设备
+            self._drop_remote_worker(worker_id)
+
+    def _drop_remote_worker(self, worker_id: str):
+        """
+        移除指定 worker 登记的全部远程设备
+
+        Args:
+            worker_id: worker 标识
+        """
+        self._worker_last_seen.pop(worker_id, None)
+        stale = [
+            device_id for device_id, info in self.remote_devices.items()
+            if info.get("worker_id") == worker_id
+        ]
+        for device_id in stale:
+            del self.remote_devices[device_id]
+        if stale:
+            logger.warning(f"worker {worker_id[:8]} 已离线，移除其设备: {len(stale)} 个")
+
+    async def _presence_heartbeat(self):
+        """
+        worker 存活心跳：定期发布 alive，并清理超时未发送心跳的 worker 的设备
+        （worker 被强制杀死或 leave 消息丢失时，远程设备不会永久残留）
+        """
+        while True:
+            try:
+                await asyncio.sleep(settings.PRESENCE_HEARTBEAT_INTERVAL)
+                await self._publish_presence("alive")
+
+                deadline = time.monotonic() - settings.PRESENCE_TTL
+                for worker_id, last_seen in list(self._worker_last_seen.items()):
+                    if last_seen < deadline:
+                        self._drop_remote_worker(worker_id)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"worker 心跳处理错误: {e}")
+
+    async def _publish_presence(self, op: str, device_id: str = None):
+        """
+        发布设备在线状态到广播总线
+
+        Args:
+            op: join/leave/sync/alive/stop
+            device_id: 设备ID
+        """
+        envelope = {
+            "kind": "presence",
+            "op": op,
+            "device_id": device_id,
+            "worker_id": self.bus.worker_id
+        }
+        if op == "join":
+            info = self.device_info.get(device_id)
+            if not info:
+                return
+            envelope["info"] = {
+                "device_name": info.get("device_name"),
+                "user_id": info.get("user_id"),
+                "username": info.get("username"),
+                "connected_at": info.get("connected_at").isoformat()
+            }
+        await self.bus.publish(envelope)
+
+    def _spawn(self, coro):
+        """在后台运行协程"""
+        try:
+            task = asyncio.get_running_loop().create_task(coro)
+        except RuntimeError:
+            coro.close()
+            return
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    def _iter_devices(self):
+        """遍历所有 worker 上的在线设备: (device_id, info)"""
+        yield from self.device_info.items()
+        for device_id, info in self.remote_devices.items():
+            if device_id not in self.device_info:
+                yield device_id, info
     
     async def broadcast_clipboard(self, clipboard_data: dict, source_device_id: str, user_id: int = None):
         """
@@ -163,7 +363,7 @@ class ConnectionManager:
         )
         
         # 计算实际发送的设备数
-        target_count = self._get_user_device_count(user_id) - 1 if user_id else len(self.active_connections) - 1
+        target_count = self._get_user_device_count(user_id) - 1 if user_id else self.get_connection_count() - 1
         logger.info(f"剪贴板同步: {source_device_id} (用户ID={user_id}) -> {target_count} 个设备")
     
     async def broadcast_system_message(self, message_type: str, data: dict, exclude_device: str = None, user_id: int = None):
@@ -195,16 +395,17 @@ class ConnectionManager:
             在线设备信息列表
         """
         devices = []
-        for device_id, info in self.device_info.items():
+        for device_id, info in self._iter_devices():
             # 如果指定了用户ID，只返回该用户的设备
             if user_id is not None and info.get("user_id") != user_id:
                 continue
-            
+
+            connected_at = info.get("connected_at")
             devices.append({
                 "device_id": device_id,
                 "device_name": info.get("device_name"),
                 "username": info.get("username"),
-                "connected_at": info.get("connected_at").isoformat()
+                "connected_at": connected_at.isoformat() if isinstance(connected_at, datetime) else connected_at
             })
         
         return devices
@@ -220,7 +421,7 @@ class ConnectionManager:
             连接数
         """
         if user_id is None:
-            return len(self.active_connections)
+            return sum(1 for _ in self._iter_devices())
         
         return self._get_user_device_count(user_id)
     
@@ -235,7 +436,7 @@ class ConnectionManager:
             该用户的设备数量
         """
         count = 0
-        for info in self.device_info.values():
+        for _, info in self._iter_devices():
             if info.get("user_id") == user_id:
                 count += 1
         return count
@@ -312,6 +513,30 @@ class ConnectionManager:
             self._queue_consumer_task.cancel()
             logger.info("队列消费者任务已取消")
 
+    async def start_bus(self):
+        """
+        启动广播总线，跨进程总线启动后请求其他 worker 的在线设备快照
+        """
+        await self.bus.start()
+        if self.bus.distributed:
+            await self._publish_presence("sync")
+            if self._presence_task is None or self._presence_task.done():
+                self._presence_task = asyncio.create_task(self._presence_heartbeat())
+
+    async def stop_bus(self):
+        """
+        停止广播总线
+        """
+        if self._presence_task and not self._presence_task.done():
+            self._presence_task.cancel()
+            try:
+                await self._presence_task
+            except asyncio.CancelledError:
+                pass
+        if self.bus.distributed:
+            await self._publish_presence("stop")
+        await self.bus.stop()
+
 
 # 全局连接管理器实例
 manager = ConnectionManager()
@@ -26,6 +26,10 @@ async def lifespan(app: FastAPI):
     db.init_engine()
     await db.create_tables()
 
+    # 启动广播总线
+    await manager.start_bus()
+    logger.info(f"广播总线已启动: {settings.BROADCAST_BACKEND}")
+
     # 启动 WebSocket 队列消费者
     manager.start_queue_consumer()
     logger.info("WebSocket 队列消费者已启动")
@@ -36,6 +40,7 @@ async def lifespan(app: FastAPI):
 
     # 关闭时执行
     manager.stop_queue_consumer()
+    await manager.stop_bus()
     await db.close()
     logger.info("应用已关闭")
 
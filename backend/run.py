@@ -8,10 +8,20 @@ from app.config import settings
 if __name__ == "__main__":
     logger.info(f"启动服务器: http://{settings.HOST}:{settings.PORT}")
     logger.info(f"API 文档: http://{settings.HOST}:{settings.PORT}/docs")
+
+    workers = settings.WORKERS
+    if settings.DEBUG and workers > 1:
+        # reload 模式下 uvicorn 只能运行单个 worker
+        logger.warning(f"DEBUG 模式启用了自动重载，忽略 WORKERS={workers}，仅启动 1 个 worker")
+        workers = 1
+
+    if workers > 1 and settings.BROADCAST_BACKEND.lower() == "memory":
+        logger.warning("多 worker 部署需要设置 BROADCAST_BACKEND=redis，否则设备间无法跨进程同步")
     
     uvicorn.run(
         "app.main:app",
         host=settings.HOST,
         port=settings.PORT,
-        reload=settings.DEBUG
+        reload=settings.DEBUG,
+        workers=workers
     )
@@ -21,6 +21,9 @@ LOG_LEVEL=${LOG_LEVEL:-INFO}
 DATABASE_PATH=/ecopaste/data/clipboard.db
 LOG_PATH=/ecopaste/logs/app
 UPLOAD_DIR=/ecopaste/uploads
+WORKERS=${WORKERS:-1}
+BROADCAST_BACKEND=${BROADCAST_BACKEND:-memory}
+BROADCAST_REDIS_URL=${BROADCAST_REDIS_URL:-redis://localhost:6379/0}
 EOF
 
 echo "✓ 生成 .env 配置文件"